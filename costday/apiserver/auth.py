@@ -1,8 +1,8 @@
 from datetime import datetime, timedelta
 from typing import Union
 
+import jwt
 from fastapi.security import OAuth2PasswordBearer
-from jose import jwt
 from passlib.context import CryptContext
 
 # to get a string like this run:
@@ -11,7 +11,25 @@ SECRET_KEY = "0d405fc8101b507f75401213ef8d33f5c326cbc142d8483d59c54951e6433527"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# resolved once instead of on every decode
+_ALGORITHMS = (ALGORITHM,)
+_KEY = jwt.get_algorithm_by_name(ALGORITHM).prepare_key(SECRET_KEY)
+
+# Argon2id with the OWASP minimum (46 MiB, t=3, p=1); tune time_cost with
+# `python -m costday.apiserver.bench_hash`. bcrypt stays for verifying
+# legacy hashes, which get rehashed on the next successful login.
+ARGON2_MEMORY_COST = 46 * 1024
+ARGON2_TIME_COST = 3
+ARGON2_PARALLELISM = 1
+
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__time_cost=ARGON2_TIME_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -20,6 +38,10 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(plain_password, hashed_password):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def get_password_hash(password):
     return pwd_context.hash(password)
 
@@ -31,5 +53,9 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+
+def decode_access_token(token: str):
+    return jwt.decode(token, _KEY, algorithms=_ALGORITHMS)
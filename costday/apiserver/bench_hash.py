@@ -0,0 +1,39 @@
+"""Time get_password_hash to tune ARGON2_TIME_COST for the deploy hardware.
+
+    python -m costday.apiserver.bench_hash --target-ms 300
+"""
+import argparse
+import time
+
+from passlib.hash import argon2
+
+from .auth import ARGON2_MEMORY_COST, ARGON2_PARALLELISM
+
+
+def time_hash(time_cost: int, rounds: int = 3) -> float:
+    hasher = argon2.using(
+        type="ID", memory_cost=ARGON2_MEMORY_COST, time_cost=time_cost, parallelism=ARGON2_PARALLELISM)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        hasher.hash("correct horse battery staple")
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target-ms", type=float, default=300)
+    parser.add_argument("--max-time-cost", type=int, default=20)
+    args = parser.parse_args()
+    if args.max_time_cost < 1:
+        parser.error("--max-time-cost must be at least 1")
+
+    for time_cost in range(1, args.max_time_cost + 1):
+        elapsed = time_hash(time_cost)
+        print(f"time_cost={time_cost}: {elapsed:.1f} ms")
+        if elapsed >= args.target_ms:
+            break
+    print(f"suggested ARGON2_TIME_COST = {time_cost}")
+
+
+if __name__ == "__main__":
+    main()
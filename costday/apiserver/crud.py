@@ -1,18 +1,68 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Annotated
 
+import anyio
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException
-from jose import jwt, JWTError
-from sqlalchemy.orm import Session
+from jwt import ExpiredSignatureError, InvalidTokenError
+from sqlalchemy import delete, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, make_transient_to_detached, selectinload
 from starlette import status
 
 from . import models, schemas, auth
-from .auth import verify_password, oauth2_scheme, SECRET_KEY, ALGORITHM
+from .database import get_db
+from .auth import decode_access_token, verify_and_update_password, oauth2_scheme
 from .schemas import TokenData
 
+# decoded JWT payloads keyed by sha256(token), so hot tokens skip jwt.decode
+_payload_cache = TTLCache(maxsize=4096, ttl=30)
+_payload_cache_lock = asyncio.Lock()
+# user column values keyed by username; a stale row can be served for up to
+# ttl seconds, so keep it short enough for password changes to propagate
+_user_cache = TTLCache(maxsize=2048, ttl=30)
+# TTLCache is not thread-safe; it is shared by threadpool handlers and the event loop
+_user_cache_lock = threading.Lock()
+
+# password verification is deliberately slow; run it on all cores without
+# tying up the request threadpool. Started by the app lifespan; with several
+# uvicorn workers, set COSTDAY_HASH_WORKERS to share the cores between them.
+_hash_pool = None
+
+_now = datetime.now
+# built once so repeated executes hit the compiled statement cache
+_USER_BOOK_INSERT = models.user_book.insert()
+
+
+def start_hash_pool():
+    global _hash_pool
+    # not fork: forking a process that already runs threads can deadlock.
+    # forkserver (spawn where it is unavailable, e.g. Windows) re-imports
+    # __main__ in the workers, so a script driving the app must guard its
+    # entry point with `if __name__ == "__main__":` or the pool breaks.
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    _hash_pool = ProcessPoolExecutor(
+        max_workers=int(os.environ.get("COSTDAY_HASH_WORKERS", 0)) or os.cpu_count(),
+        mp_context=multiprocessing.get_context(start_method),
+    )
+
+
+def shutdown_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown()
+        _hash_pool = None
+
 
 def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    return db.get(models.User, user_id)
 
 
 def get_user_by_email(db: Session, email: str):
@@ -20,45 +70,91 @@ def get_user_by_email(db: Session, email: str):
 
 
 def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+    with _user_cache_lock:
+        row = _user_cache.get(username)
+    if row is None:
+        db_user = db.query(models.User).filter(models.User.username == username).first()
+        if db_user is not None:
+            row = {column.key: getattr(db_user, column.key) for column in models.User.__table__.columns}
+            with _user_cache_lock:
+                _user_cache[username] = row
+        return db_user
+    # rebuild a clean detached instance and attach it without emitting SQL
+    db_user = models.User(**row)
+    make_transient_to_detached(db_user)
+    return db.merge(db_user, load=False)
 
 
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
+async def decode_token(token: str):
+    key = hashlib.sha256(token.encode()).digest()
+    payload = _payload_cache.get(key)
+    if payload is None:
+        # only lock the miss path, so concurrent first hits decode once
+        async with _payload_cache_lock:
+            payload = _payload_cache.get(key)
+            if payload is None:
+                payload = decode_access_token(token)
+                _payload_cache[key] = payload
+    # the cache TTL must not outlive the token itself
+    if payload.get("exp", 0) <= time.time():
+        _payload_cache.pop(key, None)
+        raise ExpiredSignatureError("Signature has expired")
+    return payload
+
+
+async def authenticate_user(db: Session, username: str, password: str):
+    user = await anyio.to_thread.run_sync(get_user_by_username, db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    # without a started pool this falls back to the default thread executor
+    verified, new_hash = await asyncio.get_running_loop().run_in_executor(
+        _hash_pool, verify_and_update_password, password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash:
+        # legacy or outdated hash, upgrade it now that we know the password
+        with _user_cache_lock:
+            _user_cache.pop(user.username, None)
+        user.hashed_password = new_hash
+        await anyio.to_thread.run_sync(db.commit)
+        # commit expired the instance; reload it here rather than lazily on the event loop
+        await anyio.to_thread.run_sync(db.refresh, user)
     return user
 
 
-async def get_current_user(db: Session, token: Annotated[str, Depends(oauth2_scheme)]):
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = await decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
-    except JWTError:
+    except InvalidTokenError:
         raise credentials_exception
-    user = get_user_by_username(db, username=token_data.username)
+    # a cache miss queries the DB, so keep it off the event loop
+    user = await anyio.to_thread.run_sync(get_user_by_username, db, token_data.username)
     if user is None:
         raise credentials_exception
     return user
 
 
 def create_user(db: Session, user: schemas.UserCreate):
-    db_user = models.User(
-        email=user.email, username=user.username, hashed_password=auth.get_password_hash(user.password))
+    return create_user_with_hash(db, user, auth.get_password_hash(user.password))
+
+
+def create_user_with_hash(db: Session, user: schemas.UserCreate, hashed_password: str):
+    with _user_cache_lock:
+        _user_cache.pop(user.username, None)
+    db_user = models.User(email=user.email, username=user.username, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
@@ -68,28 +164,37 @@ def create_user(db: Session, user: schemas.UserCreate):
 def delete_user(db: Session, user_id: int):
     db_user = get_user(db, user_id)
     if db_user:
+        with _user_cache_lock:
+            _user_cache.pop(db_user.username, None)
         db.delete(db_user)
         db.commit()
 
 
 def update_user(db: Session, user_id: int, user: schemas.UserCreate):
-    db_user = get_user(db, user_id)
-    if db_user:
-        db_user = db_user.update(user.dict())
-        db.commit()
-        return db_user
+    values = user.model_dump(exclude_unset=True, exclude={"password"})
+    if user.password:
+        values["hashed_password"] = auth.get_password_hash(user.password)
+    result = db.execute(update(models.User).where(models.User.id == user_id).values(**values))
+    db.commit()
+    # the old username is unknown without a SELECT, so drop every cached user
+    with _user_cache_lock:
+        _user_cache.clear()
+    if result.rowcount:
+        return get_user(db, user_id)
 
 
 def get_record(db: Session, record_id: int):
-    return db.query(models.Record).filter(models.Record.id == record_id).first()
+    return db.get(models.Record, record_id)
 
 
 def get_records(db: Session, book_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Record).filter(models.Record.book_id == book_id).offset(skip).limit(limit).all()
+    return db.query(models.Record).options(selectinload(models.Record.category)) \
+        .filter(models.Record.book_id == book_id).order_by(models.Record.add_at.desc()) \
+        .offset(skip).limit(limit).all()
 
 
 def create_user_record(db: Session, record: schemas.RecordCreate, user_id: int):
-    db_record = models.Record(**record.dict(), add_by=user_id, add_at=datetime.now())
+    db_record = models.Record(**record.model_dump(), add_by=user_id, add_at=_now())
     db.add(db_record)
     db.commit()
     db.refresh(db_record)
@@ -104,11 +209,12 @@ def delete_record(db: Session, record_id: int):
 
 
 def update_record(db: Session, record_id: int, record: schemas.RecordCreate):
-    db_record = get_record(db, record_id)
-    if db_record:
-        db_record = db_record.update(record.dict())
-        db.commit()
-        return db_record
+    result = db.execute(
+        update(models.Record).where(models.Record.id == record_id).values(**record.model_dump(exclude_unset=True))
+    )
+    db.commit()
+    if result.rowcount:
+        return get_record(db, record_id)
 
 
 def get_categories(db: Session, skip: int = 0, limit: int = 100):
@@ -116,11 +222,11 @@ def get_categories(db: Session, skip: int = 0, limit: int = 100):
 
 
 def get_category(db: Session, category_id: int):
-    return db.query(models.Category).filter(models.Category.id == category_id).first()
+    return db.get(models.Category, category_id)
 
 
 def create_category(db: Session, category: schemas.CategoryCreate):
-    db_category = models.Category(**category.dict())
+    db_category = models.Category(**category.model_dump())
     db.add(db_category)
     db.commit()
     db.refresh(db_category)
@@ -135,23 +241,25 @@ def delete_category(db: Session, category_id: int):
 
 
 def update_category(db: Session, category_id: int, category: schemas.CategoryCreate):
-    db_category = get_category(db, category_id)
-    if db_category:
-        db_category = db_category.update(category.dict())
-        db.commit()
-        return db_category
+    result = db.execute(
+        update(models.Category).where(models.Category.id == category_id)
+        .values(**category.model_dump(exclude_unset=True))
+    )
+    db.commit()
+    if result.rowcount:
+        return get_category(db, category_id)
 
 
 def get_books(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Book).offset(skip).limit(limit).all()
+    return db.query(models.Book).options(selectinload(models.Book.members)).offset(skip).limit(limit).all()
 
 
 def get_book(db: Session, book_id: int):
-    return db.query(models.Book).filter(models.Book.id == book_id).first()
+    return db.get(models.Book, book_id, options=[selectinload(models.Book.members)])
 
 
 def create_book(db: Session, book: schemas.BookCreate):
-    db_book = models.Book(**book.dict())
+    db_book = models.Book(**book.model_dump())
     db.add(db_book)
     db.commit()
     db.refresh(db_book)
@@ -159,11 +267,18 @@ def create_book(db: Session, book: schemas.BookCreate):
 
 
 def update_book(db: Session, book_id: int, book: schemas.BookCreate):
-    db_book = get_book(db, book_id)
-    if db_book:
-        db_book = db_book.update(book.dict())
-        db.commit()
-        return db_book
+    # members is a relationship, not a column on books; replace its rows in user_book
+    result = db.execute(
+        update(models.Book).where(models.Book.id == book_id)
+        .values(**book.model_dump(exclude_unset=True, exclude={"members"}))
+    )
+    if result.rowcount:
+        db.execute(delete(models.user_book).where(models.user_book.c.book_id == book_id))
+        if book.members:
+            db.execute(_USER_BOOK_INSERT, [{"user_id": member.id, "book_id": book_id} for member in book.members])
+    db.commit()
+    if result.rowcount:
+        return get_book(db, book_id)
 
 
 def delete_book(db: Session, book_id: int):
@@ -174,13 +289,23 @@ def delete_book(db: Session, book_id: int):
 
 
 def create_user_book(db: Session, user_book: schemas.UserBookCreate):
-    db.execute(
-        models.user_book.insert().values(user_id=user_book.user_id, book_id=user_book.book_id)
-    )
+    db.execute(_USER_BOOK_INSERT, {"user_id": user_book.user_id, "book_id": user_book.book_id})
     db.commit()
     return user_book
 
 
+def _insert_ignore(db: Session, table):
+    # INSERT that skips rows already present, so seeding is idempotent
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect in ("mysql", "mariadb"):
+        return insert(table).prefix_with("IGNORE")
+    raise NotImplementedError(f"no conflict-ignoring insert for the {dialect} dialect")
+
+
 def add_predefined_categories(db: Session):
     predefined_categories = [
         {"cn_name": "购物", "en_name": "Shop", "icon": 1},
@@ -197,10 +322,16 @@ def add_predefined_categories(db: Session):
         {"cn_name": "生活", "en_name": "Life", "icon": 10},
         {"cn_name": "其他", "en_name": "Others", "icon": 11}
     ]
-
-    for category_data in predefined_categories:
-        category_create = schemas.CategoryCreate(**category_data)
-        create_category(db=db, category=category_create)
+    # databases created before en_name was unique lack the constraint, so
+    # skip existing names here instead of relying on ON CONFLICT
+    existing = {en_name for en_name, in db.query(models.Category.en_name)}
+    predefined_categories = [
+        schemas.CategoryCreate(**category_data).model_dump() for category_data in predefined_categories
+        if category_data["en_name"] not in existing
+    ]
+    if predefined_categories:
+        db.execute(_insert_ignore(db, models.Category), predefined_categories)
+        db.commit()
 
 
 def add_predefined_users(db: Session):
@@ -208,18 +339,27 @@ def add_predefined_users(db: Session):
         {"email": "admin@126.com", "username": "admin", "password": "admin"},
         {"email": "test@126.com", "username": "test", "password": "test"}
     ]
-    for user_data in predefined_users:
-        user_create = schemas.UserCreate(**user_data)
-        create_user(db=db, user=user_create)
+    # hashing is deliberately slow, so only hash users that are not there yet
+    existing = set()
+    for username, email in db.query(models.User.username, models.User.email):
+        existing.update((username, email))
+    predefined_users = [
+        {"email": user_data["email"], "username": user_data["username"],
+         "hashed_password": auth.get_password_hash(user_data["password"])}
+        for user_data in predefined_users
+        if user_data["username"] not in existing and user_data["email"] not in existing
+    ]
+    if predefined_users:
+        db.execute(_insert_ignore(db, models.User), predefined_users)
+        db.commit()
 
 
 def add_predefined_book(db: Session):
     predefined_books = [
-        {"name": "default", "members": []},
+        {"name": "default"},
     ]
-    for book_data in predefined_books:
-        book_create = schemas.BookCreate(**book_data)
-        create_book(db=db, book=book_create)
+    db.execute(insert(models.Book), predefined_books)
+    db.commit()
 
 
 def add_predefined_user_book(db: Session):
@@ -227,9 +367,9 @@ def add_predefined_user_book(db: Session):
         {"user_id": 1, "book_id": 1},
         {"user_id": 2, "book_id": 1},
     ]
-    for user_book_data in predefined_user_books:
-        user_book_create = schemas.UserBookCreate(**user_book_data)
-        create_user_book(db=db, user_book=user_book_create)
+    # one executemany and one commit; the seed dicts already match the columns
+    db.execute(_USER_BOOK_INSERT, predefined_user_books)
+    db.commit()
 
 
 def add_records_for_test(db: Session):
@@ -239,6 +379,9 @@ def add_records_for_test(db: Session):
         {"amount": 70.2, "category_id": 2, "book_id": 1},
         {"amount": 10.5, "note": "test", "category_id": 3, "book_id": 1},
     ]
-    for record in test_records:
-        record_create = schemas.RecordCreate(**record)
-        create_user_record(db=db, record=record_create, user_id=1)
+    add_at = _now()
+    test_records = [
+        {**schemas.RecordCreate(**record).model_dump(), "add_by": 1, "add_at": add_at} for record in test_records
+    ]
+    db.execute(insert(models.Record), test_records)
+    db.commit()
@@ -1,50 +1,59 @@
 import logging
+from contextlib import asynccontextmanager
 from datetime import timedelta
 from typing import Annotated
 
-from fastapi import Depends, FastAPI, HTTPException
+import anyio
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm, HTTPBasic, HTTPBasicCredentials
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
 from starlette import status
 
-from . import crud, models, schemas
+from . import auth, crud, models, schemas
 from .auth import ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token
 from .crud import authenticate_user, get_current_user
-from .database import SessionLocal, engine
+from .database import SessionLocal, engine, get_db
+from .serializers import CachedJSON, TypeAdapterRoute
 
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
-security = HTTPBasic()
-
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-async def startup_event():
+def seed_database():
     db = SessionLocal()
     try:
+        # the sample book, its members and records have no natural key; only
+        # seed them into a new database so rows users deleted stay deleted
+        new_database = not crud.get_users(db, limit=1)
         crud.add_predefined_users(db)
         crud.add_predefined_categories(db)
-        crud.add_predefined_book(db)
-        crud.add_predefined_user_book(db)
-        crud.add_records_for_test(db)
-    except IntegrityError:
-        pass
+        if new_database:
+            crud.add_predefined_book(db)
+            crud.add_predefined_user_book(db)
+            crud.add_records_for_test(db)
     except Exception as e:
         logging.exception(e)
     finally:
         db.close()
 
 
-app.add_event_handler("startup", startup_event)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await anyio.to_thread.run_sync(seed_database)
+    crud.start_hash_pool()
+    try:
+        yield
+    finally:
+        crud.shutdown_hash_pool()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+security = HTTPBasic()
+# list endpoints, serialized through prebuilt TypeAdapters
+lists = APIRouter(route_class=TypeAdapterRoute)
+# rarely changing listings, served with ETags
+categories_json = CachedJSON(list[schemas.Category])
+books_json = CachedJSON(list[schemas.Book])
 
 
 @app.get("/")
@@ -56,7 +65,7 @@ async def greet():
 async def login_for_access_token(
         form_data: OAuth2PasswordRequestForm = Depends(),
         db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -78,14 +87,14 @@ def create_record(
     return crud.create_user_record(db=db, record=record)
 
 
-@app.get("/records", response_model=list[schemas.Record], tags=["records"])
-async def read_records(book_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@lists.get("/records", response_model=list[schemas.Record], tags=["records"])
+def read_records(book_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     db_records = crud.get_records(db, book_id=book_id, skip=skip, limit=limit)
     return db_records
 
 
 @app.get("/records/{record_id}", response_model=schemas.Record, tags=["records"])
-async def read_record(record_id, db: Session = Depends(get_db)):
+def read_record(record_id, db: Session = Depends(get_db)):
     db_record = crud.get_record(db, record_id=record_id)
     if db_record is None:
         raise HTTPException(status_code=404, detail="Record not found")
@@ -93,25 +102,30 @@ async def read_record(record_id, db: Session = Depends(get_db)):
 
 
 @app.put("/records/{record_id}", response_model=schemas.Record, tags=["records"])
-async def update_record(record_id, record: schemas.RecordCreate, db: Session = Depends(get_db)):
-    return crud.update_record(db, record_id, record)
+def update_record(record_id, record: schemas.RecordCreate, db: Session = Depends(get_db)):
+    db_record = crud.update_record(db, record_id, record)
+    if db_record is None:
+        raise HTTPException(status_code=404, detail="Record not found")
+    return db_record
 
 
 @app.delete("/records/{record_id}", tags=["records"])
-async def delete_record(record_id, db: Session = Depends(get_db)):
+def delete_record(record_id, db: Session = Depends(get_db)):
     return crud.delete_record(db, record_id)
 
 
 # users
 @app.post("/users", response_model=schemas.User, tags=["users"])
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    # argon2 is deliberately slow, keep it and the DB calls off the event loop
+    db_user = await anyio.to_thread.run_sync(crud.get_user_by_email, db, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    hashed_password = await anyio.to_thread.run_sync(auth.get_password_hash, user.password)
+    return await anyio.to_thread.run_sync(crud.create_user_with_hash, db, user, hashed_password)
 
 
-@app.get("/users", response_model=list[schemas.User], tags=["users"])
+@lists.get("/users", response_model=list[schemas.User], tags=["users"])
 def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     db_users = crud.get_users(db, skip=skip, limit=limit)
     return db_users
@@ -132,14 +146,19 @@ def read_user(user_id: int, db: Session = Depends(get_db)):
 
 @app.put("/users/{user_id}", response_model=schemas.User, tags=["users"])
 def update_user(user_id, user: schemas.UserCreate, db: Session = Depends(get_db)):
-    return crud.update_user(db, user_id, user)
+    db_user = crud.update_user(db, user_id, user)
+    # books embed their members
+    books_json.clear()
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
 
 
 # categories
-@app.get("/categories", response_model=list[schemas.Category], tags=["categories"])
-def read_categories(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    db_categories = crud.get_categories(db, skip=skip, limit=limit)
-    return db_categories
+@lists.get("/categories", response_model=list[schemas.Category], tags=["categories"])
+def read_categories(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    return categories_json.response(
+        request, (skip, limit), lambda: crud.get_categories(db, skip=skip, limit=limit))
 
 
 @app.get("/categories/{category_id}", response_model=schemas.Category, tags=["categories"])
@@ -153,6 +172,7 @@ def read_category(category_id: int, db: Session = Depends(get_db)):
 @app.post("/categories", response_model=schemas.Category, tags=["categories"])
 def create_category(category: schemas.CategoryCreate, db: Session = Depends(get_db)):
     db_category = crud.create_category(db=db, category=category)
+    categories_json.clear()
     return db_category
 
 
@@ -160,25 +180,30 @@ def create_category(category: schemas.CategoryCreate, db: Session = Depends(get_
 def update_category(category_id, category: schemas.CategoryCreate, db: Session = Depends(get_db)):
     db_category = crud.update_category(
         db=db, category_id=category_id, category=category)
+    categories_json.clear()
+    if db_category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
     return db_category
 
 
 @app.delete("/categories/{category_id}", tags=["categories"])
 def delete_category(category_id, db: Session = Depends(get_db)):
-    return crud.delete_category(db=db, category_id=category_id)
+    result = crud.delete_category(db=db, category_id=category_id)
+    categories_json.clear()
+    return result
 
 
 # books
 @app.post("/books", response_model=schemas.Book, tags=["books"])
 def create_book(book: schemas.BookCreate, db: Session = Depends(get_db)):
     db_book = crud.create_book(db=db, book=book)
+    books_json.clear()
     return db_book
 
 
-@app.get("/books", response_model=list[schemas.Book], tags=["books"])
-def read_books(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    db_books = crud.get_books(db, skip=skip, limit=limit)
-    return db_books
+@lists.get("/books", response_model=list[schemas.Book], tags=["books"])
+def read_books(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    return books_json.response(request, (skip, limit), lambda: crud.get_books(db, skip=skip, limit=limit))
 
 
 @app.get("/books/{book_id}", response_model=schemas.Book, tags=["books"])
@@ -191,14 +216,25 @@ def read_book(book_id: int, db: Session = Depends(get_db)):
 
 @app.put("/books/{book_id}", response_model=schemas.Book, tags=["books"])
 def update_book(book_id: int, book: schemas.BookCreate, db: Session = Depends(get_db)):
-    return crud.update_book(db, book_id, book)
+    db_book = crud.update_book(db, book_id, book)
+    books_json.clear()
+    if db_book is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return db_book
 
 
 @app.delete("/books/{book_id}", tags=["books"])
 def delete_book(book_id: int, db: Session = Depends(get_db)):
-    return crud.delete_book(db, book_id)
+    result = crud.delete_book(db, book_id)
+    books_json.clear()
+    return result
 
 
 @app.post("/books/{book_id}/members", tags=["books"])
 def add_book_member(book_id: int, user_id: int, db: Session = Depends(get_db)):
-    return crud.add_book_member(db, book_id, user_id)
+    result = crud.add_book_member(db, book_id, user_id)
+    books_json.clear()
+    return result
+
+
+app.include_router(lists)
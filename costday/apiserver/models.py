@@ -1,4 +1,4 @@
-from sqlalchemy import Table, Column, Float, ForeignKey, Integer, String, DATETIME
+from sqlalchemy import Table, Column, Float, ForeignKey, Index, Integer, String, DATETIME
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -42,12 +42,14 @@ class Book(Base):
 
 class Record(Base):
     __tablename__ = "records"
+    # 按账本分页、按时间倒序读取记录
+    __table_args__ = (Index("ix_records_book_addat", "book_id", "add_at"),)
 
     id = Column(Integer, primary_key=True, index=True)
     amount = Column(Float, index=True)
     note = Column(String, default=None)
     category_id = Column(Integer, ForeignKey("categories.id"), index=True)
-    book_id = Column(Integer, ForeignKey("books.id"), index=True)
+    book_id = Column(Integer, ForeignKey("books.id"))
     type_ = Column(Integer, default=1)
     add_by = Column(Integer, ForeignKey("users.id"), index=True)
     add_at = Column(DATETIME, index=True)
@@ -63,6 +65,6 @@ class Category(Base):
     parent_id = Column(Integer, index=True, default=None)
     icon = Column(Integer)
     cn_name = Column(String)
-    en_name = Column(String)
+    en_name = Column(String, unique=True)
 
     records = relationship("Record", back_populates="category")
@@ -1,5 +1,4 @@
-from typing import Union
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 from datetime import datetime
 
@@ -17,8 +16,7 @@ class UserCreate(UserBase):
 class User(UserBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UserInDB(User):
@@ -32,13 +30,13 @@ class Token(BaseModel):
 
 
 class TokenData(BaseModel):
-    username: Union[str, None] = None
+    username: str | None = None
 
 
 # 记录
 class RecordBase(BaseModel):
     amount: float
-    note: Union[str, None] = None
+    note: str | None = None
     category_id: int
     book_id: int
     type_: int = 1  # 1 expanse, 2 income
@@ -53,13 +51,12 @@ class Record(RecordBase):
     add_by: int
     add_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # 类别
 class CategoryBase(BaseModel):
-    parent_id: Union[int, None] = None
+    parent_id: int | None = None
     icon: int
     cn_name: str
     en_name: str
@@ -72,8 +69,7 @@ class CategoryCreate(CategoryBase):
 class Category(CategoryBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # 账本
@@ -89,8 +85,7 @@ class BookCreate(BookBase):
 class Book(BookBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # 账本用户
@@ -106,5 +101,4 @@ class UserBookCreate(UserBookBase):
 class UserBook(UserBookBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
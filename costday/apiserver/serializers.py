@@ -0,0 +1,87 @@
+import functools
+import hashlib
+import inspect
+import threading
+from typing import Any, Callable, Hashable
+
+from cachetools import TTLCache
+from fastapi import Request, Response
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter
+
+
+def _etag_matches(if_none_match: str | None, etag: str):
+    # If-None-Match uses weak comparison and may list several tags, or "*"
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag.removeprefix("W/") for tag in tags)
+
+
+def _to_response(adapter: TypeAdapter, content: Any):
+    if isinstance(content, Response):
+        return content
+    content = adapter.validate_python(content, from_attributes=True)
+    return Response(adapter.dump_json(content), media_type="application/json")
+
+
+def _dump_with(adapter: TypeAdapter, endpoint: Callable[..., Any]):
+    # keep the endpoint's signature and sync/async kind so FastAPI still
+    # resolves its dependencies and picks threadpool vs event loop
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            return _to_response(adapter, await endpoint(*args, **kwargs))
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            return _to_response(adapter, endpoint(*args, **kwargs))
+    return wrapper
+
+
+class TypeAdapterRoute(APIRoute):
+    """Serialize responses with a TypeAdapter built once per route.
+
+    FastAPI returns a ready Response untouched, so this skips its per-call
+    jsonable_encoder pass while response_model still drives the OpenAPI docs.
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        response_model = kwargs.get("response_model")
+        if response_model is not None and not isinstance(response_model, DefaultPlaceholder):
+            endpoint = _dump_with(TypeAdapter(response_model), endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+class CachedJSON:
+    """Encoded JSON bodies with their ETags, cached for a short TTL.
+
+    Writers call clear(); other worker processes keep serving their copy
+    until it expires, so a change can take up to ttl seconds to show up.
+    """
+
+    def __init__(self, response_model: Any, maxsize: int = 256, ttl: int = 30):
+        self.adapter = TypeAdapter(response_model)
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # TTLCache is not thread-safe and sync handlers share it
+        self._lock = threading.Lock()
+
+    def response(self, request: Request, key: Hashable, load: Callable[[], Any]):
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is None:
+            body = self.adapter.dump_json(self.adapter.validate_python(load(), from_attributes=True))
+            entry = ('"%s"' % hashlib.sha256(body).hexdigest(), body)
+            with self._lock:
+                self._cache[key] = entry
+        etag, body = entry
+        # no-cache: clients keep their copy but revalidate it with If-None-Match
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()